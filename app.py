@@ -6,27 +6,87 @@ PRISMA 2020 Flow Diagram — Flask Web App
 
 import io
 import os
-import glob
 import json
 import base64
 import sqlite3
+import hashlib
 import functools
+import threading
 from datetime import datetime
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Optional: orjson is several times faster than the stdlib json module for
+# the form snapshots saved with every diagram.  Fall back when missing.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def json_dumps(obj, sort_keys=False):
+    """Serialise ``obj`` to a JSON str (orjson when available)."""
+    if orjson is not None:
+        opt = orjson.OPT_SORT_KEYS if sort_keys else 0
+        return orjson.dumps(obj, default=str, option=opt).decode("utf-8")
+    return json.dumps(obj, sort_keys=sort_keys, default=str)
+
+def json_loads(s):
+    return orjson.loads(s) if orjson is not None else json.loads(s)
+
+# Optional: pybase64's SIMD encoder for the PNG data: URIs result pages
+# embed on Vercel (see INLINE_RESULT_IMG).
+try:
+    import pybase64
+except ImportError:
+    pybase64 = None
+
+# Optional: argon2-cffi for password hashing (see PW_METHOD).
+try:
+    import argon2
+except ImportError:
+    argon2 = None
+
+def b64_str(data):
+    """Base64-encode ``data`` (bytes) to a str (pybase64 when available)."""
+    if pybase64 is not None:
+        return pybase64.b64encode_as_string(data)
+    return base64.b64encode(data).decode("ascii")
 
 # matplotlib globals — populated lazily on first use to avoid crashing
 # the Vercel serverless function at cold-start import time.
 plt         = None
 mpatches    = None
 FancyBboxPatch = None
+PatchCollection = None
+LineCollection  = None
+FancyArrowPatch = None
+ARROW_STYLE = None      # shared "-|>" ArrowStyle for every connector arrow
 PdfPages    = None
+Figure      = None
+_mpl_lock   = threading.Lock()
 
-def _setup_matplotlib():
-    """Import matplotlib and populate module-level stubs (once)."""
-    global plt, mpatches, FancyBboxPatch, PdfPages
+def _setup_mpl_core():
+    """Import matplotlib's drawing core and populate the stubs (once, thread-safe)."""
     if plt is not None:
         return  # already imported
+    with _mpl_lock:
+        if plt is None:
+            _import_mpl_core()
+
+def _setup_mpl_pdf():
+    """Import the PDF backend — only PDF export needs it, PNG renders don't."""
+    global PdfPages
+    _setup_mpl_core()
+    if PdfPages is None:
+        from matplotlib.backends.backend_pdf import PdfPages as _PdfPages
+        PdfPages = _PdfPages
+
+def _import_mpl_core():
+    global plt, mpatches, FancyBboxPatch, PatchCollection, LineCollection
+    global FancyArrowPatch, ARROW_STYLE, Figure
     # On Vercel (read-only FS except /tmp) redirect matplotlib's config dir
-    if os.environ.get("VERCEL") or os.environ.get("VERCEL_ENV"):
+    if ((os.environ.get("VERCEL") or os.environ.get("VERCEL_ENV"))
+            and "MPLCONFIGDIR" not in os.environ):
         os.makedirs("/tmp/matplotlib", exist_ok=True)
         os.environ["MPLCONFIGDIR"] = "/tmp/matplotlib"
     import matplotlib
@@ -34,18 +94,72 @@ def _setup_matplotlib():
     import matplotlib.pyplot as _plt
     import matplotlib.patches as _mpatches
     from matplotlib.patches import FancyBboxPatch as _FancyBboxPatch
-    from matplotlib.backends.backend_pdf import PdfPages as _PdfPages
-    plt          = _plt
+    from matplotlib.collections import PatchCollection as _PatchCollection
+    from matplotlib.collections import LineCollection as _LineCollection
+    from matplotlib.figure import Figure as _Figure
     mpatches     = _mpatches
     FancyBboxPatch = _FancyBboxPatch
-    PdfPages     = _PdfPages
+    PatchCollection = _PatchCollection
+    LineCollection  = _LineCollection
+    FancyArrowPatch = _mpatches.FancyArrowPatch
+    ARROW_STYLE  = _mpatches.ArrowStyle("-|>")
+    Figure       = _Figure
+    plt          = _plt   # set last: other threads treat it as "ready"
 
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask import (Flask, render_template, request, send_file,
                    send_from_directory, session, redirect, url_for, g)
 
 app = Flask(__name__)
-app.secret_key = "prisma_2020_secret_key_systematic_review_x9z"
+# Session signing key: set FLASK_SECRET in the deployment environment; the
+# literal is only a development fallback.
+app.secret_key = os.environ.get(
+    "FLASK_SECRET", "prisma_2020_secret_key_systematic_review_x9z").encode("utf-8")
+app.config["SESSION_COOKIE_SAMESITE"] = "Lax"
+# Behind nginx/Apache with X-Sendfile support, set USE_X_SENDFILE=1 so file
+# routes only send a header and the proxy streams the file itself.  Without
+# it werkzeug already hands files to the server's wsgi.file_wrapper.
+app.config["USE_X_SENDFILE"] = os.environ.get("USE_X_SENDFILE", "") in ("1", "true", "yes")
+# Deployed templates never change, so Jinja needn't stat them on each render
+if os.environ.get("VERCEL") or os.environ.get("VERCEL_ENV"):
+    app.config["TEMPLATES_AUTO_RELOAD"] = False
+
+# Password hashing method for new accounts: "argon2" (argon2id, the default
+# when argon2-cffi is installed) or any werkzeug method string, e.g. "scrypt"
+# or PW_HASH="pbkdf2:sha256:150000" on slow hosts.  Stored hashes record
+# their own method, so existing accounts keep verifying whatever this is.
+PW_METHOD = os.environ.get("PW_HASH", "argon2" if argon2 is not None else "scrypt")
+if PW_METHOD == "argon2" and argon2 is None:
+    app.logger.warning("PW_HASH=argon2 but argon2-cffi is not installed; using scrypt")
+    PW_METHOD = "scrypt"
+# OWASP's argon2id minimum (19 MiB, t=2, p=1): several times faster per hash
+# than argon2-cffi's 64 MiB defaults.  check_needs_rehash() moves hashes
+# stored with other parameters onto these at the next login.
+_ARGON2   = (argon2.PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
+             if argon2 is not None else None)
+
+
+def hash_password(password):
+    if PW_METHOD == "argon2":
+        return _ARGON2.hash(password)
+    return generate_password_hash(password, method=PW_METHOD)
+
+
+def verify_password(stored, password):
+    """Return ``(ok, needs_rehash)``.  ``needs_rehash`` flags a correct
+    password whose stored hash should be upgraded: a werkzeug hash while
+    argon2 is configured, or an argon2 hash with outdated parameters."""
+    if stored.startswith("$argon2"):
+        if _ARGON2 is None:
+            return False, False
+        try:
+            _ARGON2.verify(stored, password)
+        except (argon2.exceptions.VerificationError,
+                argon2.exceptions.InvalidHashError):
+            return False, False
+        return True, (PW_METHOD == "argon2" and _ARGON2.check_needs_rehash(stored))
+    ok = check_password_hash(stored, password)
+    return ok, ok and PW_METHOD == "argon2" and _ARGON2 is not None
 
 BASE_DIR       = os.path.dirname(os.path.abspath(__file__))
 # On Vercel serverless the filesystem is read-only except /tmp.
@@ -57,6 +171,11 @@ else:
 IMAGES_DIR     = os.path.join(BASE_DIR, "Systematic Review images")
 DIFF_STYLE_DIR = os.path.join(BASE_DIR, "Different Style ")
 GEN_STYLE_DIR  = os.path.join(BASE_DIR, "Generated Styles")
+_IMG_EXTS      = (".png", ".jpg", ".jpeg")   # gallery image types (any case)
+# Style preview images are pre-rendered by generate_all_styles.py and only
+# change on redeploy; let browsers / the CDN keep them for a day (Flask's
+# ETag handling revalidates them cheaply after that).
+STYLE_IMG_MAX_AGE = 86400
 
 # ── Visual styles for generated diagrams (color + full structure) ──────────────────────────────────────────────────────
 DIAGRAM_STYLES = {
@@ -181,6 +300,43 @@ DIAGRAM_STYLES = {
 }
 STYLE_KEYS = list(DIAGRAM_STYLES.keys())
 
+# Stream identity accent colours (shared by every style)
+STREAM_ACCENTS = {
+    "prev":  "#6c5ce7",   # violet  — Previous Studies
+    "other": "#e07b54",   # burnt orange — Other Methods
+    "inc":   "#00a878",   # teal green — Included / Total boxes
+    "side":  "#d63031",   # red — Exclusion side boxes
+}
+
+_COLOR_KEYS = ("bg_col", "box_fg", "box_edge", "inc_fg", "inc_edge",
+               "side_fg", "side_edge", "text_col", "title_col", "arrow_col")
+_FROZEN_STYLES = {}
+
+def _frozen_style(key):
+    """DIAGRAM_STYLES[key] with every colour pre-parsed to an RGBA tuple.
+
+    Built once per style (needs matplotlib, so not at import time).  Adds
+    ``phase_fg`` / ``phase_edge`` — the per-phase main-box colours resolved
+    for phases 0-3 — and ``accents``, the parsed STREAM_ACCENTS.
+    """
+    fst = _FROZEN_STYLES.get(key)
+    if fst is None:
+        from matplotlib.colors import to_rgba
+        fst = dict(DIAGRAM_STYLES[key])
+        for k in _COLOR_KEYS:
+            if k in fst:
+                fst[k] = to_rgba(fst[k])
+        fst["phase_cols"] = tuple(to_rgba(c) for c in
+                                  fst.get("phase_cols", ["#1a3a5c"] * 5))
+        pbc = fst.get("phase_box_cols") or ()
+        fst["phase_fg"]   = tuple(to_rgba(pbc[i]["fg"]) if i < len(pbc)
+                                  else fst["box_fg"] for i in range(4))
+        fst["phase_edge"] = tuple(to_rgba(pbc[i]["edge"]) if i < len(pbc)
+                                  else fst["box_edge"] for i in range(4))
+        fst["accents"] = {k: to_rgba(c) for k, c in STREAM_ACCENTS.items()}
+        _FROZEN_STYLES[key] = fst
+    return fst
+
 # ── Explicit mapping: source label → style key ────────────────────────────────
 SOURCE_TO_STYLE = {
     "Souce 10":  "orange_flow",
@@ -200,10 +356,95 @@ SOURCE_TO_STYLE = {
 # Database helpers
 # ──────────────────────────────────────────────────────────────────────────────
 
+# One long-lived connection per process instead of a connect() per request.
+# It runs in autocommit mode (isolation_level=None), so every statement is
+# its own transaction and there is nothing to commit or close per request.
+# Sharing it across threads is safe: CPython's sqlite3 serialises access.
+_DB_CONN = None
+_DB_LOCK = threading.Lock()
+
 def get_db():
-    db = sqlite3.connect(DATABASE)
-    db.row_factory = sqlite3.Row
-    return db
+    global _DB_CONN
+    if _DB_CONN is None:
+        with _DB_LOCK:
+            if _DB_CONN is None:
+                db = sqlite3.connect(DATABASE, check_same_thread=False,
+                                     isolation_level=None)
+                db.row_factory = sqlite3.Row
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute("PRAGMA synchronous=NORMAL")
+                db.execute("PRAGMA temp_store=MEMORY")
+                db.execute("PRAGMA mmap_size=134217728")
+                db.execute("PRAGMA cache_size=-20000")    # ~20 MB page cache
+                db.execute("PRAGMA busy_timeout=5000")    # wait out writer locks
+                _DB_CONN = db
+    return _DB_CONN
+
+
+# Request-path statements.  Keeping each one a single constant string means
+# sqlite3's per-connection statement cache reuses the prepared statement
+# instead of re-parsing the SQL on every call.
+# The INSERTs hand back the new row via RETURNING (SQLite >= 3.35); read it
+# with fetchall() so the statement runs to completion and its write
+# transaction ends before the connection is used again.
+SQL_INSERT_USER     = ("INSERT INTO users (username, email, password_hash) "
+                       "VALUES (?, ?, ?) RETURNING id, username")
+SQL_USER_BY_NAME    = "SELECT * FROM users WHERE username = ?"
+SQL_SET_PASSWORD    = "UPDATE users SET password_hash = ? WHERE id = ?"
+SQL_INSERT_DIAGRAM  = ("INSERT INTO diagrams (user_id, title, img, form_data) "
+                       "VALUES (?, ?, ?, ?) RETURNING id")
+SQL_LIST_DIAGRAMS   = ("SELECT id, title, created_at FROM diagrams "
+                       "WHERE user_id = ? ORDER BY created_at DESC")
+SQL_GET_DIAGRAM     = ("SELECT title, form_data FROM diagrams "
+                       "WHERE id = ? AND user_id = ?")
+SQL_GET_DIAGRAM_IMG = "SELECT img FROM diagrams WHERE id = ? AND user_id = ?"
+SQL_DELETE_DIAGRAM  = "DELETE FROM diagrams WHERE id = ? AND user_id = ?"
+
+
+# generate_password_hash("demo1234"), precomputed so a cold start doesn't
+# spend a scrypt round hashing the fixed demo password.
+_DEMO_HASH = ("scrypt:32768:8:1$SxqNcl4H9lSQsbp1$ef4183cfc0b0ec"
+              "b1ccf9d83df9e269230e94438ac2c6d0f03c1e6fa17b3b11977767900f61aacc"
+              "321c7c379a2d8a85286cd8d8972756d44bec0da1df7ba5d65f")
+
+
+# Diagram history: the rendered PNG is stored as raw bytes (not base64 text).
+_DIAGRAMS_DDL = """
+    CREATE TABLE IF NOT EXISTS diagrams (
+        id         INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id    INTEGER NOT NULL,
+        title      TEXT,
+        img        BLOB    NOT NULL,
+        form_data  TEXT    NOT NULL,
+        created_at TEXT    DEFAULT (datetime('now')),
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    );
+"""
+
+
+def _migrate_diagrams_blob(db):
+    """One-time upgrade of a pre-BLOB diagrams table (base64 text in
+    ``img_b64``) to raw PNG bytes in ``img``.  SQLite can't decode base64,
+    so the rows are copied across in Python inside one transaction."""
+    cols = {r["name"] for r in db.execute("PRAGMA table_info(diagrams)")}
+    if "img_b64" not in cols:
+        return
+    db.execute("BEGIN")
+    try:
+        db.execute("ALTER TABLE diagrams RENAME TO diagrams_b64")
+        db.execute(_DIAGRAMS_DDL)
+        rows = db.execute("SELECT id, user_id, title, img_b64, form_data, created_at "
+                          "FROM diagrams_b64")
+        db.executemany(
+            "INSERT INTO diagrams (id, user_id, title, img, form_data, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            ((r["id"], r["user_id"], r["title"], base64.b64decode(r["img_b64"]),
+              r["form_data"], r["created_at"]) for r in rows.fetchall()))
+        db.execute("DROP TABLE diagrams_b64")
+        db.execute("COMMIT")
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
 
 
 def init_db():
@@ -216,30 +457,16 @@ def init_db():
             password_hash TEXT    NOT NULL,
             created_at    TEXT    DEFAULT (datetime('now'))
         );
+    """ + _DIAGRAMS_DDL)
+    _migrate_diagrams_blob(db)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_diagrams_user "
+               "ON diagrams (user_id, created_at DESC)")
 
-        CREATE TABLE IF NOT EXISTS diagrams (
-            id         INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id    INTEGER NOT NULL,
-            title      TEXT,
-            img_b64    TEXT    NOT NULL,
-            form_data  TEXT    NOT NULL,
-            created_at TEXT    DEFAULT (datetime('now')),
-            FOREIGN KEY (user_id) REFERENCES users(id)
-        );
-    """)
-    db.commit()
-
-    # Seed a demo account if it doesn't exist yet
-    existing = db.execute("SELECT id FROM users WHERE username = 'demo'").fetchone()
-    if not existing:
-        from werkzeug.security import generate_password_hash as _gph
-        db.execute(
-            "INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)",
-            ("demo", "demo@gmail.com", _gph("demo1234"))
-        )
-        db.commit()
-
-    db.close()
+    # Seed a demo account if it doesn't exist yet (no-op when it does)
+    db.execute(
+        "INSERT OR IGNORE INTO users (username, email, password_hash) VALUES (?, ?, ?)",
+        ("demo", "demo@gmail.com", _DEMO_HASH)
+    )
 
 
 # ──────────────────────────────────────────────────────────────────────────────
@@ -259,31 +486,50 @@ def login_required(f):
 # Diagram generator
 # ──────────────────────────────────────────────────────────────────────────────
 
+BOX_LINESPACING = 1.5   # matches the old h/(n+1) line step for typical boxes
+
 def draw_box(ax, x, y, w, h, lines, facecolor="white", edgecolor="#2c3e50",
-             lw=1.3, text_col="#333333", st=None, accent_col=None):
-    """Draw a styled PRISMA box with shadow, optional left accent bar, and text."""
+             lw=1.3, text_col="#333333", st=None, accent_col=None, batch=None):
+    """Draw a styled PRISMA box with optional drop shadow (styles with
+    ``shadow`` set), optional left accent bar, and text.
+
+    With a ``batch`` (see new_box_batch) the patches are queued instead of
+    added one by one; add_box_batch() then adds them as three collections.
+    """
     bs = st["boxstyle"] if st else "round,pad=0.05"
-    # Drop shadow — stronger when style requests it, always subtle
-    sh_alpha = 0.40 if (st and st.get("shadow")) else 0.18
-    sh_col   = "#7a8fa8" if (st and st.get("shadow")) else "#b0c0cc"
-    sp = FancyBboxPatch(
-        (x - w/2 + 0.10, y - h/2 - 0.12), w, h,
-        boxstyle=bs, linewidth=0, facecolor=sh_col, alpha=sh_alpha, zorder=2)
-    ax.add_patch(sp)
+    layers = []
+    # Drop shadow — only for styles that ask for one
+    if st and st.get("shadow"):
+        sp = FancyBboxPatch(
+            (x - w/2 + 0.10, y - h/2 - 0.12), w, h,
+            boxstyle=bs, linewidth=0, facecolor="#7a8fa8", alpha=0.40, zorder=2)
+        layers.append(("shadow", sp))
     # Main box
     box = FancyBboxPatch(
         (x - w/2, y - h/2), w, h,
         boxstyle=bs, linewidth=lw, edgecolor=edgecolor, facecolor=facecolor, zorder=3)
-    ax.add_patch(box)
+    layers.append(("main", box))
     # Colored left accent bar (inset slightly to avoid corner artifacts)
     if accent_col:
         bar_w = min(0.22, w * 0.068)
         bar = plt.Rectangle(
             (x - w/2 + 0.006, y - h/2 + 0.012), bar_w, h - 0.024,
-            facecolor=accent_col, edgecolor="none", zorder=4)
-        ax.add_patch(bar)
-    # Text
+            facecolor=accent_col, edgecolor="none", linewidth=0, zorder=4)
+        layers.append(("accent", bar))
+    for layer, patch in layers:
+        if batch is None:
+            ax.add_patch(patch)
+        else:
+            batch[layer].append(patch)
+    # Text — one multi-line artist when every line shares weight and size
     n    = len(lines)
+    if n > 1 and len({(bold, fs) for _, bold, fs in lines}) == 1:
+        _, bold, fs = lines[0]
+        ax.text(x, y, "\n".join(txt for txt, _, _ in lines),
+                ha="center", va="center", multialignment="center",
+                fontsize=fs, fontweight="bold" if bold else "normal",
+                linespacing=BOX_LINESPACING, color=text_col, zorder=5)
+        return
     step = h / (n + 1)
     for i, (txt, bold, fs) in enumerate(lines):
         ty = y + h/2 - step * (i + 1)
@@ -292,17 +538,88 @@ def draw_box(ax, x, y, w, h, lines, facecolor="white", edgecolor="#2c3e50",
                 color=text_col, zorder=5)
 
 
-def darrow(ax, x1, y1, x2, y2, color="#2c3e50", lw=1.3):
-    ax.annotate("", xy=(x2, y2), xytext=(x1, y1),
-                arrowprops=dict(arrowstyle="-|>", color=color,
-                                lw=lw, mutation_scale=17), zorder=2)
+def new_box_batch():
+    """Empty patch queues for draw_box(..., batch=...): layer name -> patches."""
+    return {"shadow": [], "main": [], "accent": []}
+
+
+def add_box_batch(ax, batch):
+    """Add queued box patches as one PatchCollection per layer (one draw call
+    each instead of one artist per patch), keeping the layers' z-order."""
+    for layer, z in (("shadow", 2), ("main", 3), ("accent", 4)):
+        if batch[layer]:
+            ax.add_collection(PatchCollection(batch[layer], match_original=True,
+                                              zorder=z), autolim=False)
 
 
-def hline(ax, x1, x2, y, color="#2c3e50", lw=1.3):
+def darrow(ax, x1, y1, x2, y2, color="#2c3e50", lw=1.3):
+    """Arrow from (x1, y1) to (x2, y2): a bare FancyArrowPatch sharing one
+    ArrowStyle, rather than an annotate() with its own Text and arrowprops."""
+    ax.add_patch(FancyArrowPatch((x1, y1), (x2, y2), arrowstyle=ARROW_STYLE,
+                                 mutation_scale=17, color=color, lw=lw,
+                                 zorder=2))
+
+
+def hline(ax, x1, x2, y, color="#2c3e50", lw=1.3, batch=None):
+    """Horizontal connector.  With a ``batch`` list the segment is queued
+    instead; add_hline_batch() then draws them all as one LineCollection."""
+    if batch is not None:
+        batch.append(((x1, y), (x2, y)))
+        return
     ax.plot([x1, x2], [y, y], color=color, lw=lw, zorder=2)
 
 
-def generate_diagram(d):
+def add_hline_batch(ax, batch, color="#2c3e50", lw=1.3):
+    if batch:
+        ax.add_collection(LineCollection(batch, colors=color, linewidths=lw,
+                                         capstyle="projecting", zorder=2),
+                          autolim=False)
+
+
+# Per-thread LRU of diagram figures, one per style: {style_key: (fig, ax,
+# static artists)}.  matplotlib isn't thread-safe, so threads never share one.
+# Each figure costs ~1.5 MB once its renderer is released after saving (see
+# _save_diagram()).
+_FIG_CACHE      = threading.local()
+FIG_CACHE_SIZE  = 4
+
+# Axes margin as a fraction of the 22 in figure: the 0.5 x 10 pt padding
+# tight_layout(pad=0.5) used to solve for on every render.  savefig's
+# bbox_inches="tight" crops to the drawing anyway.
+FIG_MARGIN = 0.5 * 10 / 72 / 22
+
+
+def _diagram_figure(style_key, draw_static):
+    """Return this thread's (fig, ax) for a style, reset to its static scene.
+
+    On first use the figure is built and ``draw_static(fig, ax)`` draws the
+    parts that depend only on the style (canvas, header banners, title);
+    those artists are remembered.  Later calls just remove everything drawn
+    on top of them by the previous render.
+    """
+    figs = getattr(_FIG_CACHE, "figs", None)
+    if figs is None:
+        figs = _FIG_CACHE.figs = OrderedDict()
+    entry = figs.get(style_key)
+    if entry is None:
+        fig = Figure(figsize=(22, 22))
+        ax  = fig.subplots()
+        fig.subplots_adjust(left=FIG_MARGIN, right=1 - FIG_MARGIN,
+                            bottom=FIG_MARGIN, top=1 - FIG_MARGIN)
+        draw_static(fig, ax)
+        entry = figs[style_key] = (fig, ax, frozenset(ax.get_children()))
+        if len(figs) > FIG_CACHE_SIZE:
+            figs.popitem(last=False)
+    else:
+        figs.move_to_end(style_key)
+    fig, ax, static = entry
+    for artist in ax.get_children():
+        if artist not in static:
+            artist.remove()
+    return fig, ax
+
+
+def _make_figure(d):
     """Three-pathway PRISMA 2020 Flow Diagram.
 
     Streams
@@ -317,34 +634,54 @@ def generate_diagram(d):
 
     Every text element uses the same Uniform Font Size (UFS = 8.0 × font_scale)
     so that no box appears to have larger or smaller text than any other.
+
+    Returns ``(fig, bg)``: this thread's cached figure for the style with the
+    diagram drawn on it, and the background colour to save it with.
     """
-    _setup_matplotlib()   # ensure matplotlib is imported before use
+    _setup_mpl_core()   # ensure matplotlib is imported before use
+    # ── Input normalisation (strip every field once) ──────────────────────────
+    v = {k: (val.strip() if isinstance(val, str) else val) for k, val in d.items()}
+
+    def pick(*keys, default="0"):
+        """First of ``keys`` present in the form (legacy names as fallbacks),
+        or ``default`` when it is missing or blank."""
+        for k in keys:
+            if k in v:
+                return v[k] or default
+        return default
+
+    def numbered(name_keys, count_keys, count):
+        """``(i, name, n)`` for the numbered field pairs 1..count where both
+        are filled; keys are ``str.format`` templates over ``i``."""
+        rows = []
+        for i in range(1, count + 1):
+            nm = pick(*(k.format(i=i) for k in name_keys),  default="")
+            n  = pick(*(k.format(i=i) for k in count_keys), default="")
+            if nm and n:
+                rows.append((i, nm, n))
+        return rows
+
     # ── Style resolution ──────────────────────────────────────────────────────
-    style_key = d.get("style", "classic")
-    st  = DIAGRAM_STYLES.get(style_key, DIAGRAM_STYLES["classic"])
-    bg  = st.get("bg_col", "white")
-    TC  = st.get("text_col", "#222222")
+    style_key = pick("style", default="classic")
+    if style_key not in DIAGRAM_STYLES:
+        style_key = "classic"
+    st  = _frozen_style(style_key)
+    bg  = st["bg_col"]
+    TC  = st["text_col"]
     ALW = max(2.0, st.get("arrow_lw", 1.5) * 1.30)   # bolder arrows
     AC  = st["arrow_col"]
     FS  = st.get("font_scale", 1.0)
     UFS = 14.0 * FS     # Uniform font size — every text element uses this
 
     # ── Stream identity accent colors ─────────────────────────────────────────
-    PREV_ACC  = "#6c5ce7"       # violet  — Previous Studies
+    PREV_ACC  = st["accents"]["prev"]
     DB_ACC    = st["box_edge"]  # primary — Databases / Registers
-    OTHER_ACC = "#e07b54"       # burnt orange — Other Methods
-    INC_ACC   = "#00a878"       # teal green — Included / Total boxes
-    SIDE_ACC  = "#d63031"       # red — Exclusion side boxes
+    OTHER_ACC = st["accents"]["other"]
+    INC_ACC   = st["accents"]["inc"]
+    SIDE_ACC  = st["accents"]["side"]
 
     # per-phase box colours (colorful style)
-    pbc = st.get("phase_box_cols")
-    def mfg(i):   return pbc[i]["fg"]   if pbc and i < len(pbc) else st["box_fg"]
-    def medge(i): return pbc[i]["edge"] if pbc and i < len(pbc) else st["box_edge"]
-
-    # ── Canvas ─────────────────────────────────────────────────────────────────
-    fig, ax = plt.subplots(figsize=(22, 22))
-    ax.set_xlim(0, 22); ax.set_ylim(0, 22); ax.axis("off")
-    fig.patch.set_facecolor(bg); ax.set_facecolor(bg)
+    MFG, MEDGE = st["phase_fg"], st["phase_edge"]
 
     # ── Column geometry ────────────────────────────────────────────────────────
     #                    centre   width
@@ -371,65 +708,77 @@ def generate_diagram(d):
     H_STD = 0.75    # Standard single-line box height
 
     # ══════════════════════════════════════════════════════════════════════════
-    # STREAM COLUMN HEADER BANNERS
+    # STATIC SCENE — canvas, stream header banners, title (cached per style)
     # ══════════════════════════════════════════════════════════════════════════
-    HDR_Y, HDR_H = 21.15, 0.44
-    for (hx, hw, label, hcol) in [
-        (PX,  PW,  "PREVIOUS STUDIES",      PREV_ACC),
-        (DX,  DW,  "DATABASES / REGISTERS", DB_ACC),
-        (OX,  OW,  "OTHER METHODS",         OTHER_ACC),
-    ]:
-        hdr = FancyBboxPatch(
-            (hx - hw/2, HDR_Y - HDR_H/2), hw, HDR_H,
-            boxstyle="round,pad=0.06",
-            facecolor=hcol, edgecolor="none", alpha=0.92, zorder=5)
-        ax.add_patch(hdr)
-        ax.text(hx, HDR_Y, label, ha="center", va="center",
-                fontsize=UFS * 0.58, fontweight="bold", color="white", zorder=6)
+    def draw_static(fig, ax):
+        ax.set_xlim(0, 22); ax.set_ylim(0, 22); ax.axis("off")
+        fig.patch.set_facecolor(bg); ax.set_facecolor(bg)
+
+        HDR_Y, HDR_H = 21.15, 0.44
+        for (hx, hw, label, hcol) in [
+            (PX,  PW,  "PREVIOUS STUDIES",      PREV_ACC),
+            (DX,  DW,  "DATABASES / REGISTERS", DB_ACC),
+            (OX,  OW,  "OTHER METHODS",         OTHER_ACC),
+        ]:
+            hdr = FancyBboxPatch(
+                (hx - hw/2, HDR_Y - HDR_H/2), hw, HDR_H,
+                boxstyle="round,pad=0.06",
+                facecolor=hcol, edgecolor="none", alpha=0.92, zorder=5)
+            ax.add_patch(hdr)
+            ax.text(hx, HDR_Y, label, ha="center", va="center",
+                    fontsize=UFS * 0.58, fontweight="bold", color="white", zorder=6)
+
+        # Decorative title with flanking accent lines
+        title_y = 21.68
+        for lx1, lx2 in [(0.8, 7.0), (15.0, 21.2)]:
+            ax.plot([lx1, lx2], [title_y, title_y],
+                    color=st["title_col"], lw=2.0, alpha=0.50, zorder=5)
+        ax.text(11.0, title_y, "PRISMA 2020 Flow Diagram",
+                ha="center", va="center", fontsize=16 * FS, fontweight="bold",
+                color=st["title_col"])
+
+    fig, ax = _diagram_figure(style_key, draw_static)
+    batch   = new_box_batch()
 
     # ══════════════════════════════════════════════════════════════════════════
     # IDENTIFICATION ROW
     # ══════════════════════════════════════════════════════════════════════════
 
     # ── Previous Studies (left) ───────────────────────────────────────────────
-    prev_n = d.get("prev_included", "0") or "0"
+    prev_n = pick("prev_included")
     h_prev = H_STD
     draw_box(ax, PX, Y_ID, PW, h_prev,
              [("Studies from previous version", False, UFS),
               (f"of review (n = {prev_n})", False, UFS)],
-             facecolor=mfg(0), edgecolor=medge(0), lw=st["box_lw"], text_col=TC, st=st,
-             accent_col=PREV_ACC)
+             facecolor=MFG[0], edgecolor=MEDGE[0], lw=st["box_lw"], text_col=TC, st=st,
+             batch=batch, accent_col=PREV_ACC)
 
     # ── Databases / Registers (centre) ───────────────────────────────────────
-    db_id   = d.get("db_identified", d.get("total_identified", "0")) or "0"
-    db_lines = []
-    for i in range(1, 7):
-        nm = d.get(f"db{i}_name", "").strip()
-        vl = d.get(f"db{i}_count", "").strip()
-        if nm and vl:
-            db_lines.append(f"  \u2022 {nm}: {vl}")
+    db_id       = pick("db_identified", "total_identified")
     db_id_rows  = [(f"Records identified from databases (n = {db_id}):", True, UFS)]
-    db_id_rows += [(ln, False, UFS) for ln in db_lines]
+    db_id_rows += [(f"  \u2022 {nm}: {vl}", False, UFS)
+                   for _, nm, vl in numbered(("db{i}_name",),
+                                             ("db{i}_count",), 6)]
     h_db_id     = max(H_STD, 0.28 * len(db_id_rows) + 0.4)
     draw_box(ax, DX, Y_ID, DW, h_db_id, db_id_rows,
-             facecolor=mfg(0), edgecolor=medge(0), lw=st["box_lw"], text_col=TC, st=st,
-             accent_col=DB_ACC)
+             facecolor=MFG[0], edgecolor=MEDGE[0], lw=st["box_lw"], text_col=TC, st=st,
+             batch=batch, accent_col=DB_ACC)
 
     # ── Other Methods (right) ─────────────────────────────────────────────────
-    other_id = d.get("other_identified", d.get("other_id_total", "0")) or "0"
+    other_id = pick("other_identified", "other_id_total")
     draw_box(ax, OX, Y_ID, OW, H_STD,
              [("Records from other methods", False, UFS),
               (f"(n = {other_id})", False, UFS)],
-             facecolor=mfg(0), edgecolor=medge(0), lw=st["box_lw"], text_col=TC, st=st,
-             accent_col=OTHER_ACC)
+             facecolor=MFG[0], edgecolor=MEDGE[0], lw=st["box_lw"], text_col=TC, st=st,
+             batch=batch, accent_col=OTHER_ACC)
 
     # ══════════════════════════════════════════════════════════════════════════
     # PRE-SCREENING REMOVAL (DB side box only)
     # ══════════════════════════════════════════════════════════════════════════
-    db_dup    = d.get("db_duplicates", d.get("duplicates", "0")) or "0"
-    db_auto   = d.get("db_automation_exc", d.get("auto_excluded", "")).strip()
-    db_oth_ex = d.get("db_other_exc",      d.get("other_removed", "")).strip()
-    pre_rows  = [(f"Records removed before screening:", True,  UFS),
+    db_dup    = pick("db_duplicates",     "duplicates")
+    db_auto   = pick("db_automation_exc", "auto_excluded", default="")
+    db_oth_ex = pick("db_other_exc",      "other_removed", default="")
+    pre_rows  = [("Records removed before screening:", True,  UFS),
                  (f"  \u2022 Duplicates (n = {db_dup})", False, UFS)]
     if db_auto:
         pre_rows.append((f"  \u2022 Automation tools (n = {db_auto})", False, UFS))
@@ -438,17 +787,17 @@ def generate_diagram(d):
     h_pre = max(0.9, 0.28 * len(pre_rows) + 0.3)
     draw_box(ax, DEX, Y_PRE, DEW, h_pre, pre_rows,
              facecolor=st["side_fg"], edgecolor=st["side_edge"],
-             lw=st["box_lw"], text_col=TC, st=st, accent_col=SIDE_ACC)
+             lw=st["box_lw"], text_col=TC, st=st, batch=batch, accent_col=SIDE_ACC)
 
     # ══════════════════════════════════════════════════════════════════════════
     # SCREENED  (DB centre column only)
     # ══════════════════════════════════════════════════════════════════════════
-    db_sc = d.get("db_screened", d.get("screened", "0")) or "0"
+    db_sc = pick("db_screened", "screened")
     sc_rows = [(f"Records screened (n = {db_sc})", True, UFS)]
     # Conflict breakdown (optional)
-    sc_inc   = d.get("sc_included",   "").strip()
-    sc_exc   = d.get("sc_excluded",   "").strip()
-    conf_tot = d.get("conflict_total","").strip()
+    sc_inc   = pick("sc_included",    default="")
+    sc_exc   = pick("sc_excluded",    default="")
+    conf_tot = pick("conflict_total", default="")
     if sc_inc:
         sc_rows.append((f"  \u2022 Agreed — Included: {sc_inc}", False, UFS))
     if sc_exc:
@@ -456,153 +805,151 @@ def generate_diagram(d):
     if conf_tot and conf_tot != "0":
         sc_rows += [
             (f"  \u2022 Conflicts (n = {conf_tot}):", False, UFS),
-            (f"       \u25e6 Included after discussion: {d.get('conflict_inc','0')}", False, UFS),
-            (f"       \u25e6 Excluded after discussion: {d.get('conflict_exc','0')}", False, UFS),
+            (f"       \u25e6 Included after discussion: {v.get('conflict_inc', '0')}", False, UFS),
+            (f"       \u25e6 Excluded after discussion: {v.get('conflict_exc', '0')}", False, UFS),
         ]
     h_sc = max(H_STD, 0.28 * len(sc_rows) + 0.3)
     draw_box(ax, DX, Y_SC, DW, h_sc, sc_rows,
-             facecolor=mfg(1), edgecolor=medge(1), lw=st["box_lw"], text_col=TC, st=st,
-             accent_col=DB_ACC)
+             facecolor=MFG[1], edgecolor=MEDGE[1], lw=st["box_lw"], text_col=TC, st=st,
+             batch=batch, accent_col=DB_ACC)
 
     # Screened exclusions side box (DB)  — EX1-EX6 coded reasons
-    db_exc_sc  = d.get("db_exc_screened", d.get("exc_screened", "0")) or "0"
+    db_exc_sc  = pick("db_exc_screened", "exc_screened")
     scx_rows   = [(f"Records excluded at screening (n = {db_exc_sc})", True, UFS)]
-    for i in range(1, 7):
-        r = d.get(f"sc_exc_code{i}", "").strip()
-        v = d.get(f"sc_exc_code{i}_n", "").strip()
-        if r and v:
-            scx_rows.append((f"  EX{i}: {r} (n = {v})", False, UFS))
+    scx_rows  += [(f"  EX{i}: {r} (n = {n})", False, UFS)
+                  for i, r, n in numbered(("sc_exc_code{i}",),
+                                          ("sc_exc_code{i}_n",), 6)]
     h_scx = max(H_STD, 0.28 * len(scx_rows) + 0.3)
     draw_box(ax, DEX, Y_SCX, DEW, h_scx, scx_rows,
              facecolor=st["side_fg"], edgecolor=st["side_edge"],
-             lw=st["box_lw"], text_col=TC, st=st, accent_col=SIDE_ACC)
+             lw=st["box_lw"], text_col=TC, st=st, batch=batch, accent_col=SIDE_ACC)
 
     # ══════════════════════════════════════════════════════════════════════════
     # SOUGHT FOR RETRIEVAL  (DB + Other)
     # ══════════════════════════════════════════════════════════════════════════
-    db_sou    = d.get("db_sought",    d.get("retrieval", "0")) or "0"
-    other_sou = d.get("other_sought", "0") or "0"
+    db_sou    = pick("db_sought", "retrieval")
+    other_sou = pick("other_sought")
     draw_box(ax, DX, Y_SOU, DW, H_STD,
              [(f"Reports sought for retrieval (n = {db_sou})", True, UFS)],
-             facecolor=mfg(2), edgecolor=medge(2), lw=st["box_lw"], text_col=TC, st=st,
-             accent_col=DB_ACC)
+             facecolor=MFG[2], edgecolor=MEDGE[2], lw=st["box_lw"], text_col=TC, st=st,
+             batch=batch, accent_col=DB_ACC)
     draw_box(ax, OX, Y_SOU, OW, H_STD,
              [(f"Reports sought (n = {other_sou})", True, UFS)],
-             facecolor=mfg(2), edgecolor=medge(2), lw=st["box_lw"], text_col=TC, st=st,
-             accent_col=OTHER_ACC)
+             facecolor=MFG[2], edgecolor=MEDGE[2], lw=st["box_lw"], text_col=TC, st=st,
+             batch=batch, accent_col=OTHER_ACC)
 
     # Not-retrieved side boxes
-    db_nr    = d.get("db_not_retrieved",    d.get("not_retrieved", "0")) or "0"
-    other_nr = d.get("other_not_retrieved", "") or ""
+    db_nr    = pick("db_not_retrieved", "not_retrieved")
+    other_nr = pick("other_not_retrieved", default="")
     draw_box(ax, DEX, Y_NR, DEW, H_STD,
              [(f"Reports not retrieved (n = {db_nr})", False, UFS)],
              facecolor=st["side_fg"], edgecolor=st["side_edge"],
-             lw=st["box_lw"], text_col=TC, st=st, accent_col=SIDE_ACC)
+             lw=st["box_lw"], text_col=TC, st=st, batch=batch, accent_col=SIDE_ACC)
     if other_nr:
         draw_box(ax, OEX, Y_NR, OEW, H_STD,
                  [(f"Not retrieved (n = {other_nr})", False, UFS)],
                  facecolor=st["side_fg"], edgecolor=st["side_edge"],
-                 lw=st["box_lw"], text_col=TC, st=st, accent_col=SIDE_ACC)
+                 lw=st["box_lw"], text_col=TC, st=st, batch=batch, accent_col=SIDE_ACC)
 
     # ══════════════════════════════════════════════════════════════════════════
     # ASSESSED FOR ELIGIBILITY  (DB + Other)
     # ══════════════════════════════════════════════════════════════════════════
-    db_ass    = d.get("db_assessed",    d.get("eligibility", "0")) or "0"
-    other_ass = d.get("other_assessed", "0") or "0"
+    db_ass    = pick("db_assessed", "eligibility")
+    other_ass = pick("other_assessed")
     draw_box(ax, DX, Y_ASS, DW, H_STD,
              [(f"Reports assessed for eligibility (n = {db_ass})", True, UFS)],
-             facecolor=mfg(3), edgecolor=medge(3), lw=st["box_lw"], text_col=TC, st=st,
-             accent_col=DB_ACC)
+             facecolor=MFG[3], edgecolor=MEDGE[3], lw=st["box_lw"], text_col=TC, st=st,
+             batch=batch, accent_col=DB_ACC)
     draw_box(ax, OX, Y_ASS, OW, H_STD,
              [(f"Assessed (n = {other_ass})", True, UFS)],
-             facecolor=mfg(3), edgecolor=medge(3), lw=st["box_lw"], text_col=TC, st=st,
-             accent_col=OTHER_ACC)
+             facecolor=MFG[3], edgecolor=MEDGE[3], lw=st["box_lw"], text_col=TC, st=st,
+             batch=batch, accent_col=OTHER_ACC)
 
     # Eligibility exclusion side boxes  (up to 6 for DB, up to 4 for Other)
-    db_exc_ft = d.get("db_exc_reasons_total", d.get("exc_fulltext", "0")) or "0"
-    db_ex_rows = [(f"Reports excluded (n = {db_exc_ft})", True, UFS)]
-    for i in range(1, 7):
-        r = d.get(f"db_exc_reason{i}", d.get(f"exc_reason{i}", "")).strip()
-        v = d.get(f"db_exc_reason{i}_n", d.get(f"exc_reason{i}_n", "")).strip()
-        if r and v:
-            db_ex_rows.append((f"  \u2022 {r}: {v}", False, UFS))
+    db_exc_ft   = pick("db_exc_reasons_total", "exc_fulltext")
+    db_ex_rows  = [(f"Reports excluded (n = {db_exc_ft})", True, UFS)]
+    db_ex_rows += [(f"  \u2022 {r}: {n}", False, UFS)
+                   for _, r, n in numbered(("db_exc_reason{i}", "exc_reason{i}"),
+                                           ("db_exc_reason{i}_n", "exc_reason{i}_n"), 6)]
     h_db_ex = max(H_STD, 0.28 * len(db_ex_rows) + 0.3)
     draw_box(ax, DEX, Y_EX, DEW, h_db_ex, db_ex_rows,
              facecolor=st["side_fg"], edgecolor=st["side_edge"],
-             lw=st["box_lw"], text_col=TC, st=st, accent_col=SIDE_ACC)
-
-    other_exc_ft = d.get("other_exc_reasons_total", "") or ""
-    if other_exc_ft or d.get("other_exc_reason1", "").strip():
-        other_ex_rows = [(f"Reports excluded (n = {other_exc_ft or '?'})", True, UFS)]
-        for i in range(1, 5):
-            r = d.get(f"other_exc_reason{i}", "").strip()
-            v = d.get(f"other_exc_reason{i}_n", "").strip()
-            if r and v:
-                other_ex_rows.append((f"  \u2022 {r}: {v}", False, UFS))
+             lw=st["box_lw"], text_col=TC, st=st, batch=batch, accent_col=SIDE_ACC)
+
+    other_exc_ft  = pick("other_exc_reasons_total", default="")
+    has_other_exc = bool(other_exc_ft or pick("other_exc_reason1", default=""))
+    if has_other_exc:
+        other_ex_rows  = [(f"Reports excluded (n = {other_exc_ft or '?'})", True, UFS)]
+        other_ex_rows += [(f"  \u2022 {r}: {n}", False, UFS)
+                          for _, r, n in numbered(("other_exc_reason{i}",),
+                                                  ("other_exc_reason{i}_n",), 4)]
         h_other_ex = max(H_STD, 0.28 * len(other_ex_rows) + 0.3)
         draw_box(ax, OEX, Y_EX, OEW, h_other_ex, other_ex_rows,
                  facecolor=st["side_fg"], edgecolor=st["side_edge"],
-                 lw=st["box_lw"], text_col=TC, st=st, accent_col=SIDE_ACC)
+                 lw=st["box_lw"], text_col=TC, st=st, batch=batch, accent_col=SIDE_ACC)
 
     # ══════════════════════════════════════════════════════════════════════════
     # INCLUDED PER STREAM  (all three columns at the same Y)
     # ══════════════════════════════════════════════════════════════════════════
-    db_inc    = d.get("db_included",    d.get("included", "0")) or "0"
-    other_inc = d.get("other_included", "0") or "0"
+    db_inc    = pick("db_included", "included")
+    other_inc = pick("other_included")
     h_inc = H_STD
 
     # Previous Studies included (left)
     draw_box(ax, PX, Y_INC, PW, h_inc,
-             [(f"Previous studies included", False, UFS),
+             [("Previous studies included", False, UFS),
               (f"(n = {prev_n})", False, UFS)],
              facecolor=st["inc_fg"], edgecolor=st["inc_edge"],
-             lw=st["inc_lw"], text_col=TC, st=st, accent_col=INC_ACC)
+             lw=st["inc_lw"], text_col=TC, st=st, batch=batch, accent_col=INC_ACC)
 
     # DB included (centre)
     draw_box(ax, DX, Y_INC, DW, h_inc,
              [(f"Studies included from databases (n = {db_inc})", True, UFS)],
              facecolor=st["inc_fg"], edgecolor=st["inc_edge"],
-             lw=st["inc_lw"], text_col=TC, st=st, accent_col=INC_ACC)
+             lw=st["inc_lw"], text_col=TC, st=st, batch=batch, accent_col=INC_ACC)
 
     # Other included (right)
     draw_box(ax, OX, Y_INC, OW, h_inc,
              [(f"Studies from other methods (n = {other_inc})", True, UFS)],
              facecolor=st["inc_fg"], edgecolor=st["inc_edge"],
-             lw=st["inc_lw"], text_col=TC, st=st, accent_col=INC_ACC)
+             lw=st["inc_lw"], text_col=TC, st=st, batch=batch, accent_col=INC_ACC)
 
     # ══════════════════════════════════════════════════════════════════════════
     # TOTAL INCLUDED (centred merge box)
     # ══════════════════════════════════════════════════════════════════════════
-    total_n = d.get("total_included", "0") or "0"
+    total_n = pick("total_included")
     h_tot   = H_STD
     draw_box(ax, TX, Y_TOT, TW, h_tot,
              [(f"Total studies included in review (n = {total_n})", True, UFS)],
              facecolor=st["inc_fg"], edgecolor=st["inc_edge"],
-             lw=st["inc_lw"] + 0.5, text_col=TC, st=st, accent_col=INC_ACC)
+             lw=st["inc_lw"] + 0.5, text_col=TC, st=st, batch=batch, accent_col=INC_ACC)
 
     # ══════════════════════════════════════════════════════════════════════════
     # ANALYTICAL BRANCHES (below Total)
     # ══════════════════════════════════════════════════════════════════════════
-    an1_txt = d.get("analysis_1_text", "").strip() or "Analysis Branch 1"
-    an1_n   = d.get("analysis_1_n",   "").strip()
-    an2_txt = d.get("analysis_2_text", "").strip() or "Analysis Branch 2"
-    an2_n   = d.get("analysis_2_n",   "").strip()
-    an1_label = f"{an1_txt}" + (f"\n(n = {an1_n})" if an1_n else "")
-    an2_label = f"{an2_txt}" + (f"\n(n = {an2_n})" if an2_n else "")
+    an1_txt = pick("analysis_1_text", default="Analysis Branch 1")
+    an1_n   = pick("analysis_1_n",    default="")
+    an2_txt = pick("analysis_2_text", default="Analysis Branch 2")
+    an2_n   = pick("analysis_2_n",    default="")
+    an1_label = f"{an1_txt}\n(n = {an1_n})" if an1_n else an1_txt
+    an2_label = f"{an2_txt}\n(n = {an2_n})" if an2_n else an2_txt
     AX1, AX2, AW = 5.5, 16.5, 5.5
     h_an = H_STD
     draw_box(ax, AX1, Y_AN, AW, h_an,
              [(an1_label, False, UFS)],
-             facecolor=mfg(3), edgecolor=medge(3), lw=st["box_lw"], text_col=TC, st=st,
-             accent_col=INC_ACC)
+             facecolor=MFG[3], edgecolor=MEDGE[3], lw=st["box_lw"], text_col=TC, st=st,
+             batch=batch, accent_col=INC_ACC)
     draw_box(ax, AX2, Y_AN, AW, h_an,
              [(an2_label, False, UFS)],
-             facecolor=mfg(3), edgecolor=medge(3), lw=st["box_lw"], text_col=TC, st=st,
-             accent_col=INC_ACC)
+             facecolor=MFG[3], edgecolor=MEDGE[3], lw=st["box_lw"], text_col=TC, st=st,
+             batch=batch, accent_col=INC_ACC)
+
+    add_box_batch(ax, batch)
 
     # ══════════════════════════════════════════════════════════════════════════
     # ARROWS — Main flow
     # ══════════════════════════════════════════════════════════════════════════
+    elbows = []     # horizontal connector segments, drawn as one collection
 
     # Previous Studies: straight arrow from top box → included box
     darrow(ax, PX, Y_ID  - H_STD/2, PX, Y_INC + H_STD/2,  AC, ALW)
@@ -621,17 +968,17 @@ def generate_diagram(d):
     # All three streams → Total Included
     # Previous (left): L-shape — down then right
     my_prv = Y_INC - H_STD/2
-    hline(ax, PX, TX - TW/2, my_prv, AC, ALW)
+    hline(ax, PX, TX - TW/2, my_prv, AC, ALW, batch=elbows)
     darrow(ax, TX - TW/2, my_prv, TX, Y_TOT + H_STD/2, AC, ALW)
 
     # DB (centre): straight down
     darrow(ax, DX, Y_INC - H_STD/2, DX, Y_TOT + H_STD/2, AC, ALW)
     # Horizontal connector from DX to TX at the side of Total box
-    hline(ax, DX, TX - TW/2 + (DX - (TX - TW/2)), Y_TOT + H_STD/2, AC, ALW)
+    hline(ax, DX, TX - TW/2 + (DX - (TX - TW/2)), Y_TOT + H_STD/2, AC, ALW, batch=elbows)
 
     # Other (right): L-shape — down then left
     my_oth = Y_INC - H_STD/2
-    hline(ax, OX, TX + TW/2, my_oth, AC, ALW)
+    hline(ax, OX, TX + TW/2, my_oth, AC, ALW, batch=elbows)
     darrow(ax, TX + TW/2, my_oth, TX, Y_TOT + H_STD/2, AC, ALW)
 
     # Total → Analysis branches
@@ -648,7 +995,7 @@ def generate_diagram(d):
     def branch_right(main_x, mx_right, side_x, sx_left, main_cy, side_cy):
         """Horizontal elbow from right edge of main box to side box."""
         mid_x = (mx_right + sx_left) / 2
-        hline(ax, mx_right, mid_x, main_cy, AC, ALW)
+        hline(ax, mx_right, mid_x, main_cy, AC, ALW, batch=elbows)
         darrow(ax, mid_x, main_cy, sx_left, side_cy, AC, ALW)
 
     # DB identification → pre-screening removal
@@ -669,13 +1016,15 @@ def generate_diagram(d):
         branch_right(OX, OX_LE, OEX, OEX_LE,
                      (Y_SOU + Y_ASS) / 2, Y_NR)
     # Other assessed → eligibility exclusions (if filled)
-    if other_exc_ft or d.get("other_exc_reason1", "").strip():
+    if has_other_exc:
         branch_right(OX, OX_LE, OEX, OEX_LE,
                      (Y_ASS + Y_INC) / 2, Y_EX)
 
+    add_hline_batch(ax, elbows, AC, ALW)
+
     # ── Phase band labels (academic / corporate / orange_flow) ────────────────
     if st.get("phase_bands"):
-        ph_cols = st.get("phase_cols", ["#1a3a5c"] * 5)
+        ph_cols = st["phase_cols"]
         phases  = [
             ("IDENTIFICATION", Y_ID,  h_db_id),
             ("SCREENING",      Y_SC,  h_sc),
@@ -699,22 +1048,105 @@ def generate_diagram(d):
                     fontsize=UFS * 0.37, fontweight="bold", color="white",
                     rotation=90, zorder=6)
 
-    # ── Title ──────────────────────────────────────────────────────────────────
-    # Decorative title with flanking accent lines
-    title_y = 21.68
-    for lx1, lx2 in [(0.8, 7.0), (15.0, 21.2)]:
-        ax.plot([lx1, lx2], [title_y, title_y],
-                color=st["title_col"], lw=2.0, alpha=0.50, zorder=5)
-    ax.text(11.0, title_y, "PRISMA 2020 Flow Diagram",
-            ha="center", va="center", fontsize=16 * FS, fontweight="bold",
-            color=st["title_col"])
-
-    fig.tight_layout(pad=0.5)
+    return fig, bg
+
+
+# Rendered PNGs keyed by a digest of the form data (LRU).  Rendering is
+# deterministic, so entries never go stale; ~0.5 MB each.
+DIAGRAM_CACHE_SIZE = 64
+_DIAGRAM_PNG_CACHE = OrderedDict()
+_DIAGRAM_PNG_LOCK  = threading.Lock()
+
+
+def _diagram_key(d):
+    blob = json_dumps(d, sort_keys=True).encode()
+    return hashlib.blake2b(blob, digest_size=16).digest()
+
+
+def generate_diagram_png(d):
+    """Render the diagram as 200 dpi PNG bytes, memoised on the form data."""
+    key = _diagram_key(d)
+    with _DIAGRAM_PNG_LOCK:
+        png = _DIAGRAM_PNG_CACHE.get(key)
+        if png is not None:
+            _DIAGRAM_PNG_CACHE.move_to_end(key)
+            return png
+    png  = None
+    pool = _render_pool()
+    if pool is not None:
+        from concurrent.futures.process import BrokenProcessPool
+        try:
+            png = pool.submit(_render_png, d).result()
+        except (BrokenProcessPool, OSError):
+            png = None   # worker died / couldn't start — render here instead
+    if png is None:
+        png = _render_png(d)
+    with _DIAGRAM_PNG_LOCK:
+        _DIAGRAM_PNG_CACHE[key] = png
+        if len(_DIAGRAM_PNG_CACHE) > DIAGRAM_CACHE_SIZE:
+            _DIAGRAM_PNG_CACHE.popitem(last=False)
+    return png
+
+
+def _save_diagram(d, **savefig_kw):
+    """Render the diagram and return ``fig.savefig(**savefig_kw)``'s bytes.
+
+    Afterwards the renderer the figure's text artists keep from the draw is
+    dropped: for a 200 dpi Agg save it is a ~75 MB pixel buffer that would
+    otherwise live as long as the cached figure.
+    """
+    fig, bg = _make_figure(d)
     buf = io.BytesIO()
-    fig.savefig(buf, format="png", dpi=200, bbox_inches="tight", facecolor=bg)
-    plt.close(fig)
-    buf.seek(0)
-    return base64.b64encode(buf.read()).decode("utf-8")
+    try:
+        fig.savefig(buf, bbox_inches="tight", facecolor=bg, **savefig_kw)
+    finally:
+        for artist in fig.findobj():
+            if getattr(artist, "_renderer", None) is not None:
+                artist._renderer = None
+    return buf.getvalue()
+
+
+def _render_png(d):
+    """Render the diagram to 200 dpi PNG bytes (no caching)."""
+    return _save_diagram(d, format="png", dpi=200)
+
+
+# Optionally run PNG renders in worker processes (RENDER_PROCESSES=N):
+# matplotlib holds the GIL while drawing, so on a multi-core server renders
+# on request threads serialise behind each other.  Off by default: every
+# worker is a full Python + matplotlib process (~100 MB RSS with its figure
+# cache), and under gunicorn each of the W server workers gets its own pool.
+RENDER_PROCESSES  = int(os.environ.get("RENDER_PROCESSES", "0"))
+_RENDER_POOL      = None
+_RENDER_POOL_LOCK = threading.Lock()
+
+
+def _render_pool():
+    """The render process pool, started on first use (None when disabled)."""
+    global _RENDER_POOL
+    if _RENDER_POOL is None and RENDER_PROCESSES > 0:
+        with _RENDER_POOL_LOCK:
+            if _RENDER_POOL is None:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                # spawn, not fork: this process already runs threads
+                _RENDER_POOL = ProcessPoolExecutor(
+                    RENDER_PROCESSES, mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_setup_mpl_core)
+    return _RENDER_POOL
+
+
+def generate_diagram_svg(d):
+    """Render the diagram as SVG bytes.
+
+    Goes through matplotlib's SVG backend, so there is no Agg rasterisation
+    or PNG compression — roughly 10x faster than generate_diagram_png().  Text is
+    written as <text> elements rather than glyph outlines, which keeps the
+    file small and the labels selectable.
+    """
+    _setup_mpl_core()
+    with plt.rc_context({"svg.fonttype": "none"}):
+        return _save_diagram(d, format="svg")
 
 
 # ──────────────────────────────────────────────────────────────────────────────
@@ -743,19 +1175,13 @@ def signup():
         else:
             db = get_db()
             try:
-                db.execute(
-                    "INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)",
-                    (username, email, generate_password_hash(password))
-                )
-                db.commit()
-                user = db.execute("SELECT * FROM users WHERE username = ?",
-                                  (username,)).fetchone()
+                pw_hash = hash_password(password)
+                user = db.execute(SQL_INSERT_USER,
+                                  (username, email, pw_hash)).fetchall()[0]
                 session["user_id"]  = user["id"]
                 session["username"] = user["username"]
-                db.close()
                 return redirect(url_for("index"))
             except sqlite3.IntegrityError as e:
-                db.close()
                 error = ("Username already taken."
                          if "username" in str(e) else "Email already registered.")
     return render_template("signup.html", error=error)
@@ -770,10 +1196,12 @@ def login():
         username = request.form.get("username", "").strip()
         password = request.form.get("password", "")
         db   = get_db()
-        user = db.execute("SELECT * FROM users WHERE username = ?",
-                          (username,)).fetchone()
-        db.close()
-        if user and check_password_hash(user["password_hash"], password):
+        user = db.execute(SQL_USER_BY_NAME, (username,)).fetchone()
+        ok, rehash = (verify_password(user["password_hash"], password)
+                      if user else (False, False))
+        if rehash:
+            db.execute(SQL_SET_PASSWORD, (hash_password(password), user["id"]))
+        if ok:
             session["user_id"]  = user["id"]
             session["username"] = user["username"]
             return redirect(url_for("index"))
@@ -801,13 +1229,8 @@ def index():
 @login_required
 def use_style_img(filename):
     """Map the selected image's source to its assigned structural style."""
-    sources = _collect_style_sources()
-    for i, src in enumerate(sources):
-        for img in src["images"]:
-            if img.replace("\\", "/") == filename:
-                key = SOURCE_TO_STYLE.get(src["label"], STYLE_KEYS[i % len(STYLE_KEYS)])
-                return redirect(f"/?style={key}")
-    return redirect("/")
+    key = _filename_to_style().get(filename)
+    return redirect(f"/?style={key}" if key else "/")
 
 
 @app.route("/clear-style")
@@ -816,24 +1239,26 @@ def clear_style():
     return redirect("/")
 
 
+# Result pages normally load the diagram from /my-diagrams/<id>/img.  On
+# Vercel the history DB lives in per-instance /tmp, so that second request
+# may reach an instance without the row: embed the PNG as a data: URI there.
+INLINE_RESULT_IMG = bool(os.environ.get("VERCEL") or os.environ.get("VERCEL_ENV"))
+
+
 @app.route("/generate", methods=["POST"])
 @login_required
 def generate():
     d = request.form.to_dict()
-    img_b64 = generate_diagram(d)
+    png = generate_diagram_png(d)
 
-    # Auto-save to this user's diagram history
+    # Auto-save to this user's diagram history (raw PNG bytes)
     title = "PRISMA Diagram \u2014 " + datetime.now().strftime("%b %d, %Y %H:%M")
     db  = get_db()
-    cur = db.execute(
-        "INSERT INTO diagrams (user_id, title, img_b64, form_data) VALUES (?, ?, ?, ?)",
-        (session["user_id"], title, img_b64, json.dumps(d))
-    )
-    new_id = cur.lastrowid
-    db.commit()
-    db.close()
+    new_id = db.execute(SQL_INSERT_DIAGRAM,
+                        (session["user_id"], title, png, json_dumps(d))).fetchall()[0][0]
 
-    return render_template("result.html", img=img_b64, data=d,
+    img = b64_str(png) if INLINE_RESULT_IMG else None
+    return render_template("result.html", img=img, data=d,
                            saved_title=title, diagram_id=new_id)
 
 
@@ -851,12 +1276,7 @@ def edit():
 @login_required
 def my_diagrams():
     db   = get_db()
-    rows = db.execute(
-        "SELECT id, title, created_at FROM diagrams "
-        "WHERE user_id = ? ORDER BY created_at DESC",
-        (session["user_id"],)
-    ).fetchall()
-    db.close()
+    rows = db.execute(SQL_LIST_DIAGRAMS, (session["user_id"],)).fetchall()
     return render_template("my_diagrams.html", diagrams=rows)
 
 
@@ -864,15 +1284,15 @@ def my_diagrams():
 @login_required
 def view_diagram(diagram_id):
     db  = get_db()
-    row = db.execute(
-        "SELECT * FROM diagrams WHERE id = ? AND user_id = ?",
-        (diagram_id, session["user_id"])
-    ).fetchone()
-    db.close()
+    row = db.execute(SQL_GET_DIAGRAM, (diagram_id, session["user_id"])).fetchone()
     if not row:
         return redirect(url_for("my_diagrams"))
-    data = json.loads(row["form_data"])
-    return render_template("result.html", img=row["img_b64"], data=data,
+    data = json_loads(row["form_data"])
+    img  = None
+    if INLINE_RESULT_IMG:
+        img = b64_str(db.execute(SQL_GET_DIAGRAM_IMG,
+                                 (diagram_id, session["user_id"])).fetchone()["img"])
+    return render_template("result.html", img=img, data=data,
                            diagram_id=diagram_id, diagram_title=row["title"])
 
 
@@ -880,37 +1300,62 @@ def view_diagram(diagram_id):
 @login_required
 def diagram_thumb(diagram_id):
     db  = get_db()
-    row = db.execute(
-        "SELECT img_b64 FROM diagrams WHERE id = ? AND user_id = ?",
-        (diagram_id, session["user_id"])
-    ).fetchone()
-    db.close()
+    row = db.execute(SQL_GET_DIAGRAM_IMG, (diagram_id, session["user_id"])).fetchone()
     if not row:
         return "", 404
-    return send_file(io.BytesIO(base64.b64decode(row["img_b64"])), mimetype="image/png")
+    # Content-hash ETag: repeat views revalidate to a bodiless 304.  The URL
+    # depends on who is logged in, so the browser must always ask first.
+    png  = row["img"]
+    etag = hashlib.blake2b(png, digest_size=16).hexdigest()
+    resp = send_file(io.BytesIO(png), mimetype="image/png", etag=etag)
+    resp.cache_control.private  = True
+    resp.cache_control.no_cache = True
+    return resp
 
 
 @app.route("/delete-diagram/<int:diagram_id>", methods=["POST"])
 @login_required
 def delete_diagram(diagram_id):
     db = get_db()
-    db.execute(
-        "DELETE FROM diagrams WHERE id = ? AND user_id = ?",
-        (diagram_id, session["user_id"])
-    )
-    db.commit()
-    db.close()
+    db.execute(SQL_DELETE_DIAGRAM, (diagram_id, session["user_id"]))
     return redirect(url_for("my_diagrams"))
 
 
 # ── Design Gallery (development screenshots) ──────────────────────────────────
 
+# Directory listings for the image galleries, cached per directory and
+# refreshed only when the directory's mtime changes: one stat() per request
+# instead of a listdir + three globs.
+_LISTING_CACHE = {}   # directory -> (st_mtime_ns, sorted (name, is_dir) pairs)
+
+def _listdir(directory):
+    """Sorted ``(name, is_dir)`` entries of ``directory`` (``()`` if it
+    doesn't exist).  A single os.scandir() pass: entry types come with the
+    directory read, so telling folders from files costs no extra stat()."""
+    try:
+        mtime = os.stat(directory).st_mtime_ns
+    except OSError:
+        return ()
+    hit = _LISTING_CACHE.get(directory)
+    if hit is not None and hit[0] == mtime:
+        return hit[1]
+    with os.scandir(directory) as it:
+        entries = tuple(sorted((e.name, e.is_dir()) for e in it))
+    _LISTING_CACHE[directory] = (mtime, entries)
+    return entries
+
+
+def _images_in(directory, exts=_IMG_EXTS):
+    """Sorted paths of the (non-hidden) image files directly in ``directory``;
+    ``exts`` are matched case-insensitively."""
+    return [os.path.join(directory, n) for n, is_dir in _listdir(directory)
+            if not is_dir and n.lower().endswith(exts) and not n.startswith(".")]
+
+
 @app.route("/gallery")
 @login_required
 def gallery():
-    paths = sorted(glob.glob(os.path.join(IMAGES_DIR, "*.png")) +
-                   glob.glob(os.path.join(IMAGES_DIR, "*.jpg")) +
-                   glob.glob(os.path.join(IMAGES_DIR, "*.jpeg")))
+    paths = _images_in(IMAGES_DIR)
     filenames = [os.path.basename(p) for p in paths]
     return render_template("gallery.html", images=filenames, total=len(filenames))
 
@@ -921,13 +1366,25 @@ def gallery_img(filename):
     return send_from_directory(IMAGES_DIR, filename)
 
 
+def _prefetch(fn, items, ahead=4):
+    """Yield ``fn(item)`` for each item in order, computing up to ``ahead``
+    results early on worker threads (bounded, so decoded images don't all
+    pile up in memory at once)."""
+    with ThreadPoolExecutor(max_workers=ahead) as ex:
+        pending = deque()
+        for item in items:
+            pending.append(ex.submit(fn, item))
+            if len(pending) >= ahead:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
 @app.route("/build-pdf")
 @login_required
 def build_pdf():
-    _setup_matplotlib()   # ensure matplotlib is imported before use
-    paths = sorted(glob.glob(os.path.join(IMAGES_DIR, "*.png")) +
-                   glob.glob(os.path.join(IMAGES_DIR, "*.jpg")) +
-                   glob.glob(os.path.join(IMAGES_DIR, "*.jpeg")))
+    _setup_mpl_pdf()   # ensure matplotlib + PDF backend are imported
+    paths = _images_in(IMAGES_DIR)
     if not paths:
         return "No images found.", 404
 
@@ -951,21 +1408,29 @@ def build_pdf():
         pdf.savefig(fig, bbox_inches="tight")
         plt.close(fig)
 
-        for i, path in enumerate(paths, 1):
-            img  = plt.imread(path)
+        # One figure for every screenshot page: resized, cleared and redrawn
+        fig, ax = plt.subplots(figsize=(10.0, 13.0))
+        fig.patch.set_facecolor("white")
+        caption = fig.text(0.5, 0.01, "", ha="center", fontsize=7,
+                           color="#aaa", style="italic")
+        sp      = fig.subplotpars
+        params  = dict(left=sp.left, right=sp.right, bottom=sp.bottom,
+                       top=sp.top, wspace=sp.wspace, hspace=sp.hspace)
+        images = _prefetch(plt.imread, paths)   # decode ahead while pages render
+        for i, (path, img) in enumerate(zip(paths, images), 1):
             h, w = img.shape[:2]
             fig_w = 10.0
             fig_h = min(fig_w * h / w, 13.0)
-            fig, ax = plt.subplots(figsize=(fig_w, fig_h))
+            fig.set_size_inches(fig_w, fig_h)
+            fig.subplots_adjust(**params)   # undo the last page's tight_layout
+            ax.clear()
             ax.imshow(img)
             ax.axis("off")
             fname = os.path.basename(path)
-            fig.text(0.5, 0.01, f"Screen {i}/{len(paths)} \u2014 {fname}",
-                     ha="center", fontsize=7, color="#aaa", style="italic")
-            fig.patch.set_facecolor("white")
+            caption.set_text(f"Screen {i}/{len(paths)} \u2014 {fname}")
             fig.tight_layout(pad=0.3)
             pdf.savefig(fig, bbox_inches="tight")
-            plt.close(fig)
+        plt.close(fig)
 
     buf.seek(0)
     return send_file(buf, mimetype="application/pdf",
@@ -975,52 +1440,48 @@ def build_pdf():
 
 # ── Download diagram ──────────────────────────────────────────────────────────
 
+# Formats besides png / pdf / svg that /download accepts.  An explicit list:
+# matplotlib also offers ps/eps/pgf (external tools, different output) and
+# uncompressed ~75 MB tiff.
+EXTRA_DOWNLOAD_FORMATS = ("jpg", "jpeg", "webp")
+
 @app.route("/download", methods=["POST"])
 @login_required
 def download():
     d   = request.form.to_dict()
     fmt = d.pop("format", "png")
-    fig = _build_fig(d)
-    buf = io.BytesIO()
-    fig.savefig(buf, format=fmt, dpi=200, bbox_inches="tight", facecolor="white")
-    plt.close(fig)
-    buf.seek(0)
-    mime = "application/pdf" if fmt == "pdf" else "image/png"
-    return send_file(buf, mimetype=mime,
+    if fmt == "svg":
+        return send_file(io.BytesIO(generate_diagram_svg(d)), mimetype="image/svg+xml",
+                         download_name="prisma_diagram.svg", as_attachment=True)
+    if fmt == "pdf":
+        # Save the vector figure straight into an in-memory PDF — no PNG
+        # render / re-embed round trip, and no temp file.
+        return send_file(io.BytesIO(_save_diagram(d, format="pdf")),
+                         mimetype="application/pdf",
+                         download_name="prisma_diagram.pdf", as_attachment=True)
+    if fmt == "png":
+        # Same 200 dpi render the result page showed — usually a cache hit
+        return send_file(io.BytesIO(generate_diagram_png(d)), mimetype="image/png",
+                         download_name="prisma_diagram.png", as_attachment=True)
+    # Raster formats Pillow writes for Agg: render the figure straight to it
+    if fmt not in EXTRA_DOWNLOAD_FORMATS:
+        return (f"Unsupported format: {fmt}", 400,
+                {"Content-Type": "text/plain; charset=utf-8"})
+    return send_file(io.BytesIO(_save_diagram(d, format=fmt, dpi=200)),
                      download_name=f"prisma_diagram.{fmt}", as_attachment=True)
 
 
-def _build_fig(d):
-    b64     = generate_diagram(d)
-    data    = base64.b64decode(b64)
-    img_buf = io.BytesIO(data)
-    fig, ax = plt.subplots(figsize=(12, 14))
-    img = plt.imread(img_buf)
-    ax.imshow(img)
-    ax.axis("off")
-    fig.tight_layout(pad=0)
-    return fig
-
-
 # ── Different Styles gallery ──────────────────────────────────────────────────
 
 def _collect_style_sources():
-    if not os.path.isdir(DIFF_STYLE_DIR):
-        return []
-    exts    = ("*.png", "*.jpg", "*.jpeg", "*.PNG", "*.JPG")
     sources = {}
-    for entry in sorted(os.listdir(DIFF_STYLE_DIR)):
-        full = os.path.join(DIFF_STYLE_DIR, entry)
-        if os.path.isdir(full):
-            imgs = []
-            for ext in exts:
-                imgs += glob.glob(os.path.join(full, ext))
-            imgs = sorted(imgs)
+    for entry, is_dir in _listdir(DIFF_STYLE_DIR):
+        if is_dir:
+            imgs = _images_in(os.path.join(DIFF_STYLE_DIR, entry))
             if imgs:
                 sources[entry] = [os.path.join(entry, os.path.basename(p))
                                    for p in imgs]
-        elif os.path.isfile(full) and any(
-                full.lower().endswith(e) for e in [".png", ".jpg", ".jpeg"]):
+        elif entry.lower().endswith(_IMG_EXTS):
             sources[entry] = [entry]
     result = []
     for label in sorted(sources.keys(), key=lambda x: x.lower()):
@@ -1033,15 +1494,13 @@ def _collect_style_sources():
 
 def _collect_generated_previews():
     """Return a list of dicts for every generated style preview."""
-    if not os.path.isdir(GEN_STYLE_DIR):
-        return []
+    folders  = {name for name, is_dir in _listdir(GEN_STYLE_DIR) if is_dir}
     previews = []
     for idx, key in enumerate(STYLE_KEYS, 1):
         st     = DIAGRAM_STYLES[key]
-        folder = os.path.join(GEN_STYLE_DIR, f"{idx:02d}_{key}")
-        if not os.path.isdir(folder):
+        if f"{idx:02d}_{key}" not in folders:
             continue
-        pngs = sorted(glob.glob(os.path.join(folder, "*.png")))
+        pngs = _images_in(os.path.join(GEN_STYLE_DIR, f"{idx:02d}_{key}"), (".png",))
         if not pngs:
             continue
         fname = os.path.basename(pngs[0])
@@ -1054,6 +1513,28 @@ def _collect_generated_previews():
     return previews
 
 
+# {image path under DIFF_STYLE_DIR: style key}, rebuilt only when one of the
+# directory listings it was derived from (DIFF_STYLE_DIR and each style
+# subfolder) changes.
+_STYLE_BY_FILE = ((), {})
+
+def _filename_to_style():
+    global _STYLE_BY_FILE
+    top      = _listdir(DIFF_STYLE_DIR)
+    listings = (top,) + tuple(_listdir(os.path.join(DIFF_STYLE_DIR, name))
+                              for name, is_dir in top if is_dir)
+    built_from, mapping = _STYLE_BY_FILE
+    if (len(built_from) != len(listings)
+            or any(a is not b for a, b in zip(built_from, listings))):
+        mapping = {}
+        for i, src in enumerate(_collect_style_sources()):
+            key = SOURCE_TO_STYLE.get(src["label"], STYLE_KEYS[i % len(STYLE_KEYS)])
+            for img in src["images"]:
+                mapping.setdefault(img.replace("\\", "/"), key)
+        _STYLE_BY_FILE = (listings, mapping)
+    return mapping
+
+
 @app.route("/styles")
 @login_required
 def styles():
@@ -1080,7 +1561,7 @@ def styles_img(filename):
         filename  = parts[1]
     if not os.path.isdir(directory):
         return "", 404
-    return send_from_directory(directory, filename)
+    return send_from_directory(directory, filename, max_age=STYLE_IMG_MAX_AGE)
 
 
 @app.route("/gen-style-img/<path:filename>")
@@ -1094,13 +1575,42 @@ def gen_style_img(filename):
         filename  = parts[1]
     if not os.path.isdir(directory):
         return "", 404
-    return send_from_directory(directory, filename)
+    return send_from_directory(directory, filename, max_age=STYLE_IMG_MAX_AGE)
 
 
 # ──────────────────────────────────────────────────────────────────────────────
 
-# Initialize DB on module load (Vercel cold start)
-init_db()
+# Initialize DB lazily on the first request rather than at import time, so a
+# Vercel cold start doesn't pay for the schema check before it can serve.
+_db_ready = False
+_db_lock  = threading.Lock()
+
+@app.before_request
+def ensure_db():
+    """Run init_db() once per process (thread-safe)."""
+    global _db_ready
+    if _db_ready:
+        return
+    with _db_lock:
+        if not _db_ready:
+            init_db()
+            _db_ready = True
+
+
+def _prewarm_fonts():
+    """Import matplotlib and render some text once, so the font cache scan
+    and first glyph shaping happen before the first diagram request."""
+    _setup_mpl_core()
+    fig = Figure(figsize=(1, 1))
+    ax  = fig.subplots()
+    ax.text(0, 0, "x", fontsize=14, fontweight="bold")
+    ax.text(0, 0, "x", fontsize=14)
+    fig.savefig(io.BytesIO(), format="png")
+
+# Long-running servers warm up in the background.  Serverless cold starts
+# skip it: api/index.py already pre-imports matplotlib after the app is up.
+if not (os.environ.get("VERCEL") or os.environ.get("VERCEL_ENV")):
+    threading.Thread(target=_prewarm_fonts, daemon=True).start()
 
 # Vercel WSGI handler
 handler = app
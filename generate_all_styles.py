@@ -12,16 +12,25 @@ Creates:
 Also creates a combined overview image (all 11 thumbnails on one page).
 """
 
-import io, os, sys, base64
+import io, os, sys
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
-# ── import the app module so we can reuse DIAGRAM_STYLES + generate_diagram ──
+# ── import the app module so we can reuse DIAGRAM_STYLES + the renderer ──────
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
-from app import DIAGRAM_STYLES, STYLE_KEYS, generate_diagram
+from app import DIAGRAM_STYLES, STYLE_KEYS, _render_png
 
+# Optional: oxipng re-compresses the style PNGs better than Pillow.
+try:
+    import oxipng
+except ImportError:
+    oxipng = None
+
+import numpy as np
+from PIL import Image
 import matplotlib
 matplotlib.use("Agg")
 import matplotlib.pyplot as plt
-import matplotlib.image as mpimg
 
 BASE_DIR   = os.path.dirname(os.path.abspath(__file__))
 OUTPUT_DIR = os.path.join(BASE_DIR, "Generated Styles")
@@ -56,11 +65,43 @@ SAMPLE_DATA = {
 }
 
 
+def _style_data(key):
+    d = dict(SAMPLE_DATA)
+    d["style"] = key
+    return d
+
+
+def _shrink_png(png):
+    """Losslessly re-compress PNG bytes (oxipng if installed, else Pillow)."""
+    if oxipng is not None:
+        return oxipng.optimize_from_memory(png, level=2)
+    out = io.BytesIO()
+    im  = Image.open(io.BytesIO(png))
+    im.save(out, format="PNG", optimize=True, dpi=im.info.get("dpi", (200, 200)))
+    return out.getvalue()
+
+
+def render_style_png(d):
+    """PNG for the served style images, losslessly shrunk: they are
+    rendered once here and downloaded on every styles page."""
+    return _shrink_png(_render_png(d))
+
+
+def render_all():
+    """PNG bytes for every style, rendered in parallel on every core (spawn:
+    importing app already started threads in this process)."""
+    datas = [_style_data(key) for key in STYLE_KEYS]
+    with ProcessPoolExecutor(os.cpu_count(),
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        return list(pool.map(render_style_png, datas))
+
+
 def main():
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     generated_paths = []
+    buffers         = render_all()
 
-    for idx, key in enumerate(STYLE_KEYS, 1):
+    for idx, (key, png_bytes) in enumerate(zip(STYLE_KEYS, buffers), 1):
         style_info = DIAGRAM_STYLES[key]
         style_name = style_info["name"]
         safe_name  = style_name.replace(" ", "_").replace("&", "and")
@@ -69,13 +110,7 @@ def main():
         folder = os.path.join(OUTPUT_DIR, f"{idx:02d}_{key}")
         os.makedirs(folder, exist_ok=True)
 
-        # Generate diagram
-        d = dict(SAMPLE_DATA)
-        d["style"] = key
-        b64_png = generate_diagram(d)
-
         # Save PNG
-        png_bytes = base64.b64decode(b64_png)
         filename  = f"PRISMA_{safe_name}.png"
         filepath  = os.path.join(folder, filename)
         with open(filepath, "wb") as f:
@@ -94,7 +129,8 @@ def main():
 
     for i, ax in enumerate(axes.flat):
         if i < len(generated_paths):
-            img = mpimg.imread(generated_paths[i])
+            # decode the bytes already in memory instead of re-reading the file
+            img = np.asarray(Image.open(io.BytesIO(buffers[i])))
             ax.imshow(img)
             key  = STYLE_KEYS[i]
             name = DIAGRAM_STYLES[key]["name"]
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+Pre-compile the project's .py files to bytecode before deploying.
+
+Run once at build time (vercel.json's buildCommand does this on deploy):
+
+    python warmup.py
+
+The .pyc files are written next to the sources (the standard __pycache__
+layout) and validated by source hash rather than mtime, so they remain valid
+after Vercel copies the project into /var/task.  A cold start then loads the
+cached bytecode instead of re-parsing and re-compiling app.py.
+"""
+
+import os
+import re
+import sys
+import compileall
+import py_compile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def main():
+    ok = compileall.compile_dir(
+        ROOT, quiet=1, legacy=False,
+        rx=re.compile(r"[\\/](\.venv|venv|\.git)[\\/]"),
+        invalidation_mode=py_compile.PycInvalidationMode.CHECKED_HASH,
+    )
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())